@@ -1,15 +1,16 @@
 import os
 import time
-import requests
-import threading
-import google.generativeai as genai
+import html
+import asyncio
 import logging
-import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException
 
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from postmarker.core import PostmarkClient
+
+from fetch import http_client, get_new_substack_posts, extract_text_from_url, reset_feed_validators
+from mailer import send_email
+from state import get_last_processed_url, load_state, save_last_processed_url, was_processed
+from summarize import summarize_text
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -23,181 +24,234 @@ load_dotenv()
 
 # Configuration
 SUBSTACK_URL = os.getenv("SUBSTACK_BLOG_URL")  # Your Substack URL
-GOOGLE_AI_API_KEY = os.getenv("GEMINI_API_KEY")  # Get this from Google AI Studio
-POSTMARK_SERVER_TOKEN = os.getenv("POSTMARK_API_TOKEN")  # Get this from SendGrid
-SENDER_EMAIL = os.getenv("EMAIL_SENDER")  # Your email address
-RECEIVER_EMAILS = os.getenv("EMAIL_RECEIVERS")  # Your email address
 SLEEP_SECONDS = int(os.getenv("CHECK_INTERVAL", "3600"))  # Default to 1 hour if not specified
 PING_INTERVAL = 600  # Ping every 10 minutes to prevent idle shutdown
-
-# Configure Gemini
-genai.configure(api_key=GOOGLE_AI_API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash-lite-001')
+WEBHOOK_TOKEN = os.getenv("WEBHOOK_TOKEN")  # Shared secret for the /webhook/new-post endpoint
+POLLING_FALLBACK = os.getenv("POLLING_FALLBACK", "0") == "1"  # Keep the old polling loop as a safety net
 
 # Global vars
-last_processed = ""
 worker_active = False
-worker_thread = None
 ping_active = False
-ping_thread = None
+# Queue of post URLs pushed by the webhook endpoint, drained by the consumer task
+post_queue = asyncio.Queue()
 # Get the service URL from environment, or default to localhost for development
 SERVICE_URL = os.getenv("SERVICE_URL", "http://localhost:8080")
 
-def get_last_processed_url():
-    """Reads the last processed URL from the global variable."""
-    global last_processed
-    return last_processed
-
-def save_last_processed_url(url):
-    """Saves the last processed URL to the global variable."""
-    global last_processed
-    last_processed = url
-
-def get_latest_substack_post_url(substack_url):
-    """Fetches the Substack homepage and extracts the URL of the latest post."""
-    try:
-        response = requests.get(substack_url)
-        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-        soup = BeautifulSoup(response.content, "html.parser")
-        
-        # Adjust this selector according to your specific substack website structure
-        first_post_link = soup.find("a", class_="sitemap-link") 
-        if not first_post_link:
-            logger.error("Could not find a post link with class name 'sitemap-link'. Check your substack URL and selectors")
-            return None
-        post_url = first_post_link['href'] 
-        return post_url
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching Substack homepage: {e}")
-        return None
-
-def extract_text_from_url(url):
-    """Fetches the content of a URL and extracts the main text."""
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, "html.parser")
-        
-        content_div = soup.find("div", class_="body") 
-        if not content_div:
-            logger.error("Could not find the main content div with class name 'body'. Check your substack URL and selectors")
-            return None
-        paragraphs = content_div.find_all("p") 
-        text = "\n".join(p.get_text() for p in paragraphs)
-        return text
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching or parsing the URL: {e}")
-        return None
-
-def summarize_text(text, api_key):
-    """Summarizes the text using Google's Gemini API."""
-    try:
-        prompt = f"Summarize the following text and \
-            format it to be sent as HtmlBody parameter in a email API. \
-                Don't add triple backticks to denote the block of text. \
-                simply the HTML without even HEAD or BODY tags.\
-                \n{text}\n\nSummary:"
-        response = model.generate_content(prompt)
+async def process_post(url, text=None):
+    """Runs the extract -> summarize -> email pipeline for a single post URL.
+
+    Pass `text` when the post body is already in hand (e.g. embedded in the
+    feed) to skip the extra fetch of the post page."""
+    if was_processed(url):
+        logger.info(f"Post already processed, skipping: {url}")
+        return False
+
+    logger.info(f"New post found: {url}")
+    if text is None:
+        text = await extract_text_from_url(url)
+
+    if not text:
+        logger.warning("Failed to extract text.")
+        return False
+
+    logger.info("Generating summary with Gemini")
+    summary = await summarize_text(text)
+
+    if not summary:
+        logger.warning("Failed to summarize text.")
+        return False
+
+    logger.info(f"Sending email summary of {url}")
+
+    # The summary is already HTML (per the Gemini prompt); only the intro line
+    # needs escaping before the two are joined
+    html_body = f'<p>Summary of <a href="{html.escape(url)}">{html.escape(url)}</a>:</p>{summary}'
+
+    if not await send_email("Summary of the latest EAS503 Substack post", html_body):
+        logger.warning("Failed to send email, will retry next cycle.")
+        return False
+
+    save_last_processed_url(url)
+    return True
+
+# Stage widths for the catch-up pipeline; queues are bounded for backpressure
+PIPELINE_FETCHERS = 4
+PIPELINE_SUMMARIZERS = 2
+PIPELINE_QUEUE_SIZE = 16
+
+async def process_posts_batch(posts):
+    """Pipelines fetch -> summarize -> digest email across several new posts.
+
+    `posts` is a list of (url, text) pairs, oldest first, with text=None for
+    posts whose body wasn't embedded in the feed. The stages are connected by
+    bounded queues so fetches overlap in-flight Gemini calls: wall time is
+    governed by the slowest stage instead of the sum of all of them."""
+    logger.info(f"Catching up on {len(posts)} new posts")
+
+    url_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    text_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    summary_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    async def fetcher():
+        while True:
+            item = await url_q.get()
+            if item is None:
+                break
+            url, text = item
+            if text is None:
+                text = await extract_text_from_url(url)
+            if text:
+                await text_q.put((url, text))
+            else:
+                logger.warning(f"Failed to extract text from {url}, leaving it for the next cycle")
+
+    async def summarizer():
+        while True:
+            item = await text_q.get()
+            if item is None:
+                break
+            url, text = item
+            summary = await summarize_text(text)
+            if summary:
+                await summary_q.put((url, summary))
+            else:
+                logger.warning(f"Failed to summarize {url}, leaving it for the next cycle")
+
+    async def mailer():
+        # Collect per-post summaries and send them as one digest
+        collected = {}
+        while True:
+            item = await summary_q.get()
+            if item is None:
+                break
+            url, summary = item
+            collected[url] = summary
+
+        if not collected:
+            logger.warning("Failed to summarize posts.")
+            return False
+
+        # Only the contiguous oldest-first run of successes can be finalized:
+        # the feed scan stops at the first already-seen item, so marking a
+        # post newer than a failed one would hide that failure forever.
+        # Successes past the first gap stay queued for the next cycle — their
+        # summaries are memoized, so the retry is cheap.
+        prefix = []
+        for url, _ in posts:
+            if url not in collected:
+                break
+            prefix.append((url, collected[url]))
+
+        if not prefix:
+            logger.warning("Oldest post in the batch failed, deferring the digest to the next cycle.")
+            return False
+
+        if len(prefix) < len(posts):
+            logger.warning(f"Digest covers {len(prefix)} of {len(posts)} posts, the rest retry next cycle")
+
+        html_body = "".join(
+            f'<p>Summary of <a href="{html.escape(url)}">{html.escape(url)}</a>:</p>{summary}'
+            for url, summary in prefix
+        )
 
-        if response.prompt_feedback and response.prompt_feedback.block_reason:
-            logger.error(f"The prompt was blocked because of: {response.prompt_feedback.block_reason}")
-            return None # Handle the blocked prompt appropriately
+        if not await send_email(f"Summary of {len(prefix)} new EAS503 Substack posts", html_body):
+            logger.warning("Failed to send digest email, will retry next cycle.")
+            return False
 
-        return response.text.strip()
+        for url, _ in prefix:
+            save_last_processed_url(url)
+        return len(prefix) == len(posts)
 
-    except Exception as e:
-        logger.error(f"Error during Gemini summarization: {e}")
-        return None
+    fetchers = [asyncio.create_task(fetcher()) for _ in range(PIPELINE_FETCHERS)]
+    summarizers = [asyncio.create_task(summarizer()) for _ in range(PIPELINE_SUMMARIZERS)]
+    mailer_task = asyncio.create_task(mailer())
 
-def send_simple_message(subject, body, sender_email, receiver_email, postmark_server_token):
     try:
-        postmark = PostmarkClient(server_token=postmark_server_token)
-        
-        result = postmark.emails.send(
-            From=sender_email,
-            To=receiver_email,
-            Subject=subject,
-            HtmlBody="<p>" + body.replace("\n", "</p><p>") + "</p>",
-        )
-        logger.info(f"Email sent successfully: {result}")
-        return result
-    except Exception as e:
-        logger.error(f"Error sending email: {e}")
-        return None
-
-def worker_process():
-    """Main function to orchestrate the process."""
+        # Feed the first stage, then drain each stage with one sentinel per worker
+        for post in posts:
+            await url_q.put(post)
+        for _ in range(PIPELINE_FETCHERS):
+            await url_q.put(None)
+        await asyncio.gather(*fetchers)
+
+        for _ in range(PIPELINE_SUMMARIZERS):
+            await text_q.put(None)
+        await asyncio.gather(*summarizers)
+
+        await summary_q.put(None)
+        return await mailer_task
+    finally:
+        # If a stage raised, the downstream sentinels were never enqueued;
+        # cancel whatever is still waiting so no tasks leak. Cancelling
+        # finished tasks is a no-op.
+        stage_tasks = [*fetchers, *summarizers, mailer_task]
+        for task in stage_tasks:
+            task.cancel()
+        await asyncio.gather(*stage_tasks, return_exceptions=True)
+
+async def consume():
+    """Drains the webhook queue and runs the pipeline for each pushed post URL."""
+    logger.info("Webhook consumer started")
+    while True:
+        url = await post_queue.get()
+        try:
+            await process_post(url)
+        except Exception as e:
+            logger.error(f"Error processing webhook post {url}: {e}")
+        finally:
+            post_queue.task_done()
+
+async def worker_process():
+    """Polling fallback: periodically checks for new posts (enabled via POLLING_FALLBACK=1)."""
     global worker_active
-    last_processed_url = get_last_processed_url()
-    
-    logger.info("Background worker started")
-    
+
+    logger.info("Background polling worker started")
+
     while worker_active:
         try:
             logger.info(f"Checking for new posts at {SUBSTACK_URL}")
-            latest_post_url = get_latest_substack_post_url(SUBSTACK_URL)
+            posts = await get_new_substack_posts(SUBSTACK_URL)
 
-            if not latest_post_url:
-                logger.warning("Failed to retrieve latest post URL. Retrying...")
-                time.sleep(SLEEP_SECONDS)
+            if posts is None:
+                logger.warning("Failed to retrieve new posts. Retrying...")
+                await asyncio.sleep(SLEEP_SECONDS)
                 continue
 
-            if latest_post_url != last_processed_url:
-                logger.info(f"New post found: {latest_post_url}")
-                text = extract_text_from_url(latest_post_url)
-
-                if not text:
-                    logger.warning("Failed to extract text. Retrying...")
-                    time.sleep(SLEEP_SECONDS)
-                    continue
-
-                logger.info("Generating summary with Gemini")
-                summary = summarize_text(text, GOOGLE_AI_API_KEY)
-
-                if not summary:
-                    logger.warning("Failed to summarize text. Retrying...")
-                    time.sleep(SLEEP_SECONDS)
-                    continue
-
-                logger.info(f"Sending email summary of {latest_post_url}")
-                
-                send_simple_message(
-                    subject="Summary of the latest EAS503 Substack post",
-                    body=f"Summary of {latest_post_url}:\n\n{summary}",
-                    sender_email=SENDER_EMAIL,
-                    receiver_email=RECEIVER_EMAILS,
-                    postmark_server_token=POSTMARK_SERVER_TOKEN,
-                )
-
-                save_last_processed_url(latest_post_url)
-                last_processed_url = latest_post_url 
-
-            else:
+            if not posts:
                 logger.info("No new posts found.")
+            else:
+                if len(posts) == 1:
+                    url, text = posts[0]
+                    await process_post(url, text=text)
+                else:
+                    await process_posts_batch(posts)
+
+                # Posts that failed mid-pipeline never reached the seen set; a
+                # 304 on the next poll would hide them, so force a full refetch
+                if any(not was_processed(url) for url, _ in posts):
+                    reset_feed_validators()
 
             logger.info(f"Sleeping for {SLEEP_SECONDS} seconds")
-            time.sleep(SLEEP_SECONDS)
-            
+            await asyncio.sleep(SLEEP_SECONDS)
+
         except Exception as e:
             logger.error(f"Error in worker process: {e}")
-            time.sleep(SLEEP_SECONDS)  # Sleep and continue even if there's an error
+            await asyncio.sleep(SLEEP_SECONDS)  # Sleep and continue even if there's an error
 
-def self_ping():
-    """Ping itself regularly to prevent Render from shutting down due to inactivity."""
+async def keepalive():
+    """Pings itself regularly to prevent Render from shutting down due to inactivity."""
     global ping_active
-    
-    logger.info(f"Self-ping service started, will ping {SERVICE_URL}/health every {PING_INTERVAL} seconds")
-    
+
+    logger.info(f"Keepalive task started, will ping {SERVICE_URL}/health every {PING_INTERVAL} seconds")
+
     while ping_active:
         try:
-            response = requests.get(f"{SERVICE_URL}/health")
+            response = await http_client.get(f"{SERVICE_URL}/health")
             logger.info(f"Self-ping: {response.status_code} - {response.text}")
         except Exception as e:
             logger.error(f"Error during self-ping: {e}")
-        
-        time.sleep(PING_INTERVAL)
+
+        await asyncio.sleep(PING_INTERVAL)
 
 # FastAPI routes
 @app.get("/")
@@ -206,65 +260,91 @@ def index():
         "status": "running",
         "worker_active": worker_active,
         "ping_active": ping_active,
-        "last_processed": last_processed or "None"
+        "last_processed": get_last_processed_url() or "None"
     }
 
 @app.get("/health")
 def health():
     return {"status": "healthy", "timestamp": time.time()}
 
+@app.post("/webhook/new-post", status_code=202)
+async def webhook_new_post(payload: dict, x_webhook_token: str = Header(default=None)):
+    """Receives new-post notifications (e.g. from an RSS-to-webhook bridge) and queues them."""
+    if WEBHOOK_TOKEN and x_webhook_token != WEBHOOK_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid webhook token")
+
+    url = payload.get("url")
+    if not url:
+        raise HTTPException(status_code=422, detail="Missing 'url' in payload")
+
+    await post_queue.put(url)
+    return {"status": "queued", "url": url}
+
 @app.post("/start")
-def start_worker():
-    global worker_active, worker_thread
-    
+async def start_worker():
+    global worker_active
+
     if not worker_active:
         worker_active = True
-        worker_thread = threading.Thread(target=worker_process)
-        worker_thread.daemon = True  # This makes the thread exit when the main program exits
-        worker_thread.start()
+        app.state.worker_task = asyncio.create_task(worker_process())
         return {"status": "worker started"}
     else:
         return {"status": "worker already running"}
 
 @app.post("/stop")
-def stop_worker():
+async def stop_worker():
     global worker_active
-    
+
     if worker_active:
         worker_active = False
-        return {"status": "worker stopping - will finish current cycle"}
+        # Cancellation interrupts the sleep, so the worker stops right away
+        app.state.worker_task.cancel()
+        return {"status": "worker stopped"}
     else:
         return {"status": "worker not running"}
 
 # Startup event
 @app.on_event("startup")
-def on_startup():
-    global worker_active, worker_thread, ping_active, ping_thread
-    # Start the background worker
-    worker_active = True
-    worker_thread = threading.Thread(target=worker_process)
-    worker_thread.daemon = True
-    worker_thread.start()
-    
-    # Start the self-ping service
+async def on_startup():
+    global worker_active, ping_active
+    # Restore processed-post history so a restart doesn't re-run the pipeline
+    load_state()
+
+    # Start the webhook consumer task
+    app.state.consumer_task = asyncio.create_task(consume())
+
+    # Start the polling worker only as a fallback when webhooks can't be configured
+    if POLLING_FALLBACK:
+        worker_active = True
+        app.state.worker_task = asyncio.create_task(worker_process())
+
+    # Start the self-ping keepalive task
     ping_active = True
-    ping_thread = threading.Thread(target=self_ping)
-    ping_thread.daemon = True
-    ping_thread.start()
-    
-    logger.info("FastAPI application started with background worker and self-ping service")
+    app.state.ping_task = asyncio.create_task(keepalive())
+
+    logger.info("FastAPI application started with webhook consumer and keepalive task")
 
 # Shutdown event
 @app.on_event("shutdown")
-def on_shutdown():
+async def on_shutdown():
     global worker_active, ping_active
     worker_active = False
     ping_active = False
-    logger.info("FastAPI application shutting down, worker and ping service stopping")
+    for name in ("consumer_task", "worker_task", "ping_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    await http_client.aclose()
+    logger.info("FastAPI application shutting down, background tasks cancelled")
 
 if __name__ == "__main__":
+    # uvicorn is only needed when serving, so import it here to keep module
+    # import (and anything that just wants the pipeline functions) lighter
+    import uvicorn
+
     # Get the port from environment variable for Render compatibility
     port = int(os.environ.get("PORT", 8080))
-    
-    # Start the FastAPI app with uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
\ No newline at end of file
+
+    # Start the FastAPI app with uvicorn on uvloop, which roughly halves
+    # event-loop overhead for this network-heavy workload
+    uvicorn.run(app, host="0.0.0.0", port=port, loop="uvloop", http="httptools", log_level="info")
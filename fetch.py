@@ -0,0 +1,132 @@
+import httpx
+import logging
+import xml.etree.ElementTree as ET
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from state import was_processed
+
+logger = logging.getLogger(__name__)
+
+# Shared HTTP client: connection pooling + HTTP/2 avoids a fresh TCP/TLS handshake per fetch
+http_client = httpx.AsyncClient(http2=True, timeout=10)
+
+# Cache validators from the previous index fetch, for conditional GETs
+last_etag = None
+last_modified = None
+
+def reset_feed_validators():
+    """Forgets the stored validators so the next poll refetches the feed in full.
+
+    Must be called when a cycle ends with unprocessed posts: the validators are
+    stored as soon as the feed returns 200, so without a reset every following
+    poll would get a 304 and the failed posts would never be retried until the
+    feed content itself changed."""
+    global last_etag, last_modified
+    last_etag = None
+    last_modified = None
+
+# RSS namespace for the full post body embedded in feed items
+CONTENT_ENCODED = "{http://purl.org/rss/1.0/modules/content/}encoded"
+
+# Strainers let the parser discard everything outside the nodes each
+# extractor actually reads, instead of building the full DOM
+_BODY_STRAINER = SoupStrainer("div", class_="body")
+_PARAGRAPH_STRAINER = SoupStrainer("p")
+
+async def get_new_substack_posts(substack_url):
+    """Fetches the Substack RSS feed and returns [(url, text), ...] for every unseen post.
+
+    Posts come back oldest-first so digests read chronologically. The text is
+    taken from the body embedded in the feed item when present (saving the
+    separate fetch of the post page) and is None otherwise. Returns an empty
+    list when there is nothing new, or None when the feed couldn't be read."""
+    global last_etag, last_modified
+    feed_url = f"{substack_url.rstrip('/')}/feed"
+    try:
+        # Conditional GET: a 304 transfers no body and skips the parse entirely
+        headers = {}
+        if last_etag:
+            headers["If-None-Match"] = last_etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        posts = []
+        saw_item = False
+        async with http_client.stream("GET", feed_url, headers=headers) as response:
+            if response.status_code == 304:
+                logger.info("Substack feed unchanged (304), skipping parse")
+                return []
+            response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+
+            last_etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+            # Feed the body into the parser as it arrives instead of buffering
+            # it whole. Items are newest-first, so the first already-seen item
+            # means everything after it is older — stop reading there.
+            parser = ET.XMLPullParser(events=["end"])
+            done = False
+            async for chunk in response.aiter_bytes():
+                parser.feed(chunk)
+                for _, elem in parser.read_events():
+                    if elem.tag != "item":
+                        continue
+                    saw_item = True
+                    link = elem.findtext("link")
+                    link = link.strip() if link else None
+                    if link and was_processed(link):
+                        done = True
+                        break
+                    if link:
+                        embedded_html = elem.findtext(CONTENT_ENCODED)
+                        text = extract_text_from_feed_html(embedded_html) if embedded_html else None
+                        posts.append((link, text))
+                    elem.clear()  # drop the item's subtree once handled
+                if done:
+                    break
+
+        if not saw_item:
+            logger.error(f"Could not find any posts in the RSS feed at {feed_url}. Check your substack URL")
+            return None
+
+        posts.reverse()  # oldest first
+        return posts
+
+    except ET.ParseError as e:
+        logger.error(f"Error parsing the Substack feed: {e}")
+        # The 200's validators were already stored; drop them or the retry
+        # would 304 and never see this feed version again
+        reset_feed_validators()
+        return None
+    except httpx.HTTPError as e:
+        logger.error(f"Error fetching Substack feed: {e}")
+        reset_feed_validators()
+        return None
+
+def extract_text_from_feed_html(content):
+    """Extracts the post text from the HTML embedded in a feed item."""
+    soup = BeautifulSoup(content, "lxml", parse_only=_PARAGRAPH_STRAINER)
+    paragraphs = soup.find_all("p")
+    if not paragraphs:
+        return None
+    return "\n".join(p.get_text() for p in paragraphs)
+
+async def extract_text_from_url(url):
+    """Fetches the content of a URL and extracts the main text."""
+    try:
+        response = await http_client.get(url)
+        response.raise_for_status()
+        soup = BeautifulSoup(response.content, "lxml", parse_only=_BODY_STRAINER)
+
+        content_div = soup.find("div", class_="body")
+        if not content_div:
+            logger.error("Could not find the main content div with class name 'body'. Check your substack URL and selectors")
+            return None
+        paragraphs = content_div.find_all("p")
+        text = "\n".join(p.get_text() for p in paragraphs)
+        return text
+
+    except httpx.HTTPError as e:
+        logger.error(f"Error fetching or parsing the URL: {e}")
+        return None
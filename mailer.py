@@ -0,0 +1,66 @@
+import os
+import random
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+from postmarker.core import PostmarkClient
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables from .env file (idempotent across modules)
+load_dotenv()
+
+POSTMARK_SERVER_TOKEN = os.getenv("POSTMARK_API_TOKEN")  # Get this from Postmark
+SENDER_EMAIL = os.getenv("EMAIL_SENDER")  # Your email address
+RECEIVER_EMAILS = os.getenv("EMAIL_RECEIVERS")  # Your email address
+
+# Shared Postmark client: constructing one per send tears down its pooled
+# TLS connection and costs a fresh handshake every email
+_postmark = None
+POSTMARK_CONCURRENCY = 2
+_postmark_sem = asyncio.Semaphore(POSTMARK_CONCURRENCY)
+MAX_RETRIES = 5
+
+def get_postmark_client(server_token):
+    """Returns the shared PostmarkClient, creating it on first use."""
+    global _postmark
+    if _postmark is None:
+        _postmark = PostmarkClient(server_token=server_token)
+    return _postmark
+
+def send_simple_message(subject, html_body, sender_email, receiver_email, postmark_server_token):
+    try:
+        postmark = get_postmark_client(postmark_server_token)
+
+        result = postmark.emails.send(
+            From=sender_email,
+            To=receiver_email,
+            Subject=subject,
+            HtmlBody=html_body,
+        )
+        logger.info(f"Email sent successfully: {result}")
+        return result
+    except Exception as e:
+        logger.error(f"Error sending email: {e}")
+        return None
+
+async def send_email(subject, html_body):
+    """Sends an email off the event loop, bounded and retried like the Gemini calls."""
+    async with _postmark_sem:
+        for attempt in range(MAX_RETRIES):
+            result = await asyncio.to_thread(
+                send_simple_message,
+                subject=subject,
+                html_body=html_body,
+                sender_email=SENDER_EMAIL,
+                receiver_email=RECEIVER_EMAILS,
+                postmark_server_token=POSTMARK_SERVER_TOKEN,
+            )
+            if result is not None:
+                return result
+            if attempt < MAX_RETRIES - 1:
+                delay = 2 ** attempt + random.random()
+                logger.warning(f"Email send failed, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    return None
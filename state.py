@@ -0,0 +1,65 @@
+import os
+import logging
+
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+last_processed = ""
+# Bounded memory of recently processed URLs: a lone last_processed string
+# would reprocess (and re-email) a post whenever the feed flaps or a retry
+# resurfaces an already-handled URL
+SEEN_MAXLEN = 256
+_seen = set()
+_seen_order = deque(maxlen=SEEN_MAXLEN)
+# Processed URLs survive restarts here, one per line, oldest first
+STATE_FILE = os.getenv("STATE_FILE", "last_processed.txt")
+
+def get_last_processed_url():
+    """Reads the last processed URL from the global variable."""
+    global last_processed
+    return last_processed
+
+def was_processed(url):
+    """Returns True if the URL was handled recently."""
+    return url in _seen
+
+def _remember(url):
+    """Adds the URL to the in-memory seen set, evicting the oldest when full."""
+    if url in _seen:
+        return
+    if len(_seen_order) == SEEN_MAXLEN:
+        _seen.discard(_seen_order[0])
+    _seen_order.append(url)
+    _seen.add(url)
+
+def load_state():
+    """Restores the processed-URL history from STATE_FILE, if present."""
+    global last_processed
+    try:
+        with open(STATE_FILE) as f:
+            urls = [line.strip() for line in f if line.strip()]
+    except OSError:
+        return
+    for url in urls[-SEEN_MAXLEN:]:
+        _remember(url)
+    if urls:
+        last_processed = urls[-1]
+        logger.info(f"Restored {len(_seen)} processed URL(s) from {STATE_FILE}")
+
+def save_state():
+    """Writes the processed-URL history to STATE_FILE via an atomic rename."""
+    tmp = STATE_FILE + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write("\n".join(_seen_order) + "\n")
+        os.replace(tmp, STATE_FILE)  # atomic: a crash mid-write can't corrupt the state
+    except OSError as e:
+        logger.error(f"Error persisting state to {STATE_FILE}: {e}")
+
+def save_last_processed_url(url):
+    """Records the URL as processed and persists the updated history."""
+    global last_processed
+    last_processed = url
+    _remember(url)
+    save_state()
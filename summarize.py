@@ -0,0 +1,143 @@
+import os
+import time
+import random
+import hashlib
+import datetime
+import asyncio
+import logging
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from collections import deque
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables from .env file (idempotent across modules)
+load_dotenv()
+
+# Configure Gemini
+GOOGLE_AI_API_KEY = os.getenv("GEMINI_API_KEY")  # Get this from Google AI Studio
+genai.configure(api_key=GOOGLE_AI_API_KEY)
+GEMINI_MODEL_NAME = 'gemini-2.0-flash-lite-001'
+model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+# Static part of the summarization prompt, cached server-side so its tokens
+# aren't re-billed and re-encoded on every call
+SUMMARY_INSTRUCTION = (
+    "Summarize the following text and format it to be sent as HtmlBody parameter "
+    "in a email API. Don't add triple backticks to denote the block of text. "
+    "simply the HTML without even HEAD or BODY tags."
+)
+CACHE_TTL_SECONDS = 3600
+_cached_model = None
+_cache_expires_at = 0.0
+# Serializes cache creation: concurrent summarizers racing past the expiry
+# check would each create (and bill) a server-side cache for the full TTL
+_cache_lock = asyncio.Lock()
+
+# Summaries keyed by article-content hash, so a retry after a transient
+# failure later in the pipeline doesn't re-bill a Gemini call; bounded so a
+# long-running process doesn't hoard every summary it ever produced
+SUMMARY_CACHE_MAXLEN = 64
+_summary_cache = {}
+_summary_cache_order = deque(maxlen=SUMMARY_CACHE_MAXLEN)
+
+def _cache_summary(key, summary):
+    """Stores a summary in the memo cache, evicting the oldest when full."""
+    if key in _summary_cache:
+        return
+    if len(_summary_cache_order) == SUMMARY_CACHE_MAXLEN:
+        _summary_cache.pop(_summary_cache_order[0], None)
+    _summary_cache_order.append(key)
+    _summary_cache[key] = summary
+
+# Cap concurrent Gemini calls so pipelined catch-ups saturate the rate limit
+# without tripping 429s, and retry transient failures with backoff instead of
+# abandoning the whole cycle
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "4"))
+_gemini_sem = asyncio.Semaphore(GEMINI_CONCURRENCY)
+MAX_RETRIES = 5
+
+def get_summary_model():
+    """Returns a model backed by a cached system instruction, recreating the cache when its TTL lapses.
+
+    Falls back to the plain model if the caching API is unavailable (e.g. the
+    prompt is below the cacheable minimum for the configured model). The
+    failure is remembered for a full TTL as well, so summarizations don't pay
+    a doomed cache-creation round-trip each time."""
+    global _cached_model, _cache_expires_at
+    if _cached_model and time.time() < _cache_expires_at:
+        return _cached_model
+    try:
+        cache = genai.caching.CachedContent.create(
+            model=GEMINI_MODEL_NAME,
+            system_instruction=SUMMARY_INSTRUCTION,
+            ttl=datetime.timedelta(seconds=CACHE_TTL_SECONDS),
+        )
+        _cached_model = genai.GenerativeModel.from_cached_content(cached_content=cache)
+        # Refresh a minute before the server-side TTL actually expires
+        _cache_expires_at = time.time() + CACHE_TTL_SECONDS - 60
+        logger.info(f"Created Gemini prompt cache {cache.name}")
+        return _cached_model
+    except Exception as e:
+        logger.warning(f"Could not create Gemini prompt cache, using uncached model: {e}")
+        # Stick with the plain model until the cooldown lapses instead of
+        # retrying (and warning) on every call
+        _cached_model = model
+        _cache_expires_at = time.time() + CACHE_TTL_SECONDS
+        return model
+
+async def summarize_text(text):
+    """Summarizes the text using Google's Gemini API, streaming the response."""
+    key = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    if key in _summary_cache:
+        logger.info("Summary cache hit, skipping Gemini call")
+        return _summary_cache[key]
+
+    try:
+        # Cache creation/refresh is a blocking SDK call; the lock keeps
+        # concurrent callers from each creating their own server-side cache
+        # (on the memoized fast path it's held only for the expiry check)
+        async with _cache_lock:
+            summary_model = await asyncio.to_thread(get_summary_model)
+        # Passing the pieces as separate content parts skips concatenating the
+        # static instruction onto a potentially large article string, and lets
+        # the SDK line the parts up with the server-side prompt cache
+        if summary_model is model:
+            # Uncached fallback: the instruction has to travel with the request
+            contents = [SUMMARY_INSTRUCTION, text, "\n\nSummary:"]
+        else:
+            # The instruction lives in the server-side cache; send only the article
+            contents = [text, "\n\nSummary:"]
+
+        # Streaming lets chunks accumulate as they arrive instead of blocking
+        # until the whole response is generated
+        async with _gemini_sem:
+            for attempt in range(MAX_RETRIES):
+                try:
+                    response = await summary_model.generate_content_async(contents, stream=True)
+                    chunks = []
+                    async for chunk in response:
+                        chunks.append(chunk.text)
+                    break
+                except (google_exceptions.ResourceExhausted,
+                        google_exceptions.InternalServerError,
+                        google_exceptions.ServiceUnavailable) as e:
+                    if attempt == MAX_RETRIES - 1:
+                        raise
+                    delay = 2 ** attempt + random.random()
+                    logger.warning(f"Gemini call failed ({e}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+        if response.prompt_feedback and response.prompt_feedback.block_reason:
+            logger.error(f"The prompt was blocked because of: {response.prompt_feedback.block_reason}")
+            return None # Handle the blocked prompt appropriately
+
+        summary = "".join(chunks).strip()
+        _cache_summary(key, summary)
+        return summary
+
+    except Exception as e:
+        logger.error(f"Error during Gemini summarization: {e}")
+        return None